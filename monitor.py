@@ -7,26 +7,67 @@ If the key remains absent beyond the specified grace period, it locks the screen
 """
 
 import os
+import select
 import subprocess
 import time
 import signal
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 import notify2
 import daemon
 import daemon.pidfile
 from yubi_detect import YubiDetect
 
+_LOCK_DEFAULT: List[str] = ["loginctl", "lock-session"]
+# Lock command per desktop, in detection priority order.
+_LOCK_DISPATCH: Dict[str, List[str]] = {
+    "gnome": ["gnome-screensaver-command", "-l"],
+    "kde": _LOCK_DEFAULT,
+    "xfce": ["xflock4"],
+    "cinnamon": ["cinnamon-screensaver-command", "-l"],
+    "mate": ["mate-screensaver-command", "-l"],
+    "lxde": ["lxlock"],
+    "sway": ["swaylock"],
+}
+_DESKTOP_ALIASES: Dict[str, str] = {"x-cinnamon": "cinnamon"}
+
+# The session environment does not change at runtime, so read it once.
+_XDG_CURRENT_DESKTOP: Tuple[str, ...] = tuple(os.environ.get("XDG_CURRENT_DESKTOP", "").lower().split(":"))
+_WAYLAND: bool = bool(os.environ.get("WAYLAND_DISPLAY"))
+
+
+def _detect_gui(desktops: Tuple[str, ...] = _XDG_CURRENT_DESKTOP, wayland: bool = _WAYLAND) -> Optional[str]:
+    """
+    Detect the current GUI environment from the lowercased XDG_CURRENT_DESKTOP tokens.
+    """
+    parts = {_DESKTOP_ALIASES.get(part, part) for part in desktops}
+    hit = parts & _LOCK_DISPATCH.keys()
+    if hit:
+        return next(gui for gui in _LOCK_DISPATCH if gui in hit)
+    return "sway" if wayland else None
+
+
+_GUI: Optional[str] = _detect_gui()
+
 
 class Monitor:
     """
     Monitors the YubiKey state and triggers screen locking upon prolonged absence.
     """
     NOTIFICATION_TITLE: str = "Yubikey Notification Service"
+    POLL_BACKOFF_MAX: int = 30  # Longest sleep between polls while nothing changes.
+    REINSERTED_NOTIFICATION_SECONDS: float = 3.0  # How long the reinsertion notice stays up.
 
-    def __init__(self, grace_period: int = 10, detector: Optional[YubiDetect] = None) -> None:
+    def __init__(
+        self,
+        grace_period: int = 10,
+        detector: Optional[YubiDetect] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
         notify2.init('Yubikey pressense tracker')
-        
-        self.detection_instance: YubiDetect = detector if detector is not None else YubiDetect(True)
+
+        self._clock: Callable[[], float] = clock  # Monotonic seconds, injectable for tests.
+
+        self.detection_instance: YubiDetect = detector if detector is not None else YubiDetect(False)
         self.key_present: bool = self.detection_instance.search_yubikey_exists()
         self.previous_present: bool = self.key_present
         self.active_countdown: bool = False
@@ -34,12 +75,11 @@ class Monitor:
         self.seconds_grace: int = grace_period
         self.last_notification_id: notify2.Notification = notify2.Notification("", "", "")
         self.active_monitor: bool = True
-        self.running: bool = True  # Controls the main monitoring loop
+        self._notification_close_due: Optional[float] = None  # Monotonic time to close the notification.
 
-
-    def send_notification(self, title: str, message: str) -> Optional[str]:
+    def send_notification(self, title: str, message: str) -> None:
         """
-        Send a desktop notification using notify-send.
+        Show or update the desktop notification, reusing the notify2 D-Bus connection.
         """
         self.last_notification_id.update(title, message)
         self.last_notification_id.show()
@@ -64,71 +104,10 @@ class Monitor:
         """
         Lock the screen using the detected desktop environment's lock command.
         """
-        def lock_gnome() -> None:
-            subprocess.run(["gnome-screensaver-command", "-l"], check=False)
-
-        def lock_kde() -> None:
-            lock_default()
-
-        def lock_xfce() -> None:
-            subprocess.run(["xflock4"], check=False)
-
-        def lock_cinnamon() -> None:
-            subprocess.run(["cinnamon-screensaver-command", "-l"], check=False)
-
-        def lock_mate() -> None:
-            subprocess.run(["mate-screensaver-command", "-l"], check=False)
-
-        def lock_lxde() -> None:
-            subprocess.run(["lxlock"], check=False)
-
-        def lock_sway() -> None:
-            subprocess.run(["swaylock"], check=False)
-
-        def lock_default() -> None:
-            subprocess.run(["loginctl", "lock-session"], check=False)
-
-        def detect_gui() -> Optional[str]:
-            """
-            Detect the current GUI environment.
-            """
-            desktop: str = os.environ.get("XDG_CURRENT_DESKTOP", "").lower()
-            if "gnome" in desktop:
-                return "gnome"
-            if "kde" in desktop:
-                return "kde"
-            if "xfce" in desktop:
-                return "xfce"
-            if "cinnamon" in desktop:
-                return "cinnamon"
-            if "mate" in desktop:
-                return "mate"
-            if "lxde" in desktop:
-                return "lxde"
-            if "sway" in desktop or os.environ.get("WAYLAND_DISPLAY"):
-                return "sway"
-            return None
-
-        gui: Optional[str] = detect_gui()
         try:
-            if gui == "gnome":
-                lock_gnome()
-            elif gui == "kde":
-                lock_kde()
-            elif gui == "xfce":
-                lock_xfce()
-            elif gui == "cinnamon":
-                lock_cinnamon()
-            elif gui == "mate":
-                lock_mate()
-            elif gui == "lxde":
-                lock_lxde()
-            elif gui == "sway":
-                lock_sway()
-            else:
-                lock_default()
+            subprocess.run(_LOCK_DISPATCH.get(_GUI, _LOCK_DEFAULT), check=False)
         except Exception:
-            lock_default()
+            subprocess.run(_LOCK_DEFAULT, check=False)
 
         self.active_monitor = False  # Prevent further actions after locking
         self.send_notification(self.NOTIFICATION_TITLE, "YubiKey removed. Locking screen.")
@@ -141,7 +120,16 @@ class Monitor:
         self._reset_countdown()
         self.send_notification(self.NOTIFICATION_TITLE, "YubiKey has been reinserted.")
         self.active_monitor = True
-        time.sleep(3)
+        # Close the notice from a later iteration instead of stalling detection here.
+        self._notification_close_due = self._clock() + self.REINSERTED_NOTIFICATION_SECONDS
+
+    def _close_notification_if_due(self) -> None:
+        """
+        Close the reinsertion notification once it has been shown long enough.
+        """
+        if self._notification_close_due is None or self._clock() < self._notification_close_due:
+            return
+        self._notification_close_due = None
         self.last_notification_id.close()
         self.last_notification_id = notify2.Notification("", "", "")
 
@@ -149,10 +137,12 @@ class Monitor:
         """
         Increment the countdown when the key is absent and send a notification.
         """
+        self._notification_close_due = None  # The countdown takes the notification over.
         if self.countdown_iteration == 0:
             self.send_notification(self.NOTIFICATION_TITLE, "Key has been removed.")
         else:
             self.send_notification(self.NOTIFICATION_TITLE, f"Key absent for {self.countdown_iteration} second(s) out of {self.seconds_grace}.")
+        self.active_countdown = True
         self.countdown_iteration += 1
 
     def should_lock(self) -> bool:
@@ -165,6 +155,7 @@ class Monitor:
         """
         Execute one iteration of the monitoring loop.
         """
+        self._close_notification_if_due()
         present: bool = self.detection_instance.search_yubikey_exists()
         if present:
             if not self.previous_present:
@@ -176,13 +167,73 @@ class Monitor:
                     self.lock_screen()
         self.previous_present = present
 
-    def monitor(self) -> None:
+    def _poll_interval(self, stable_ticks: int) -> int:
         """
-        Continuously monitor the YubiKey state until the daemon is stopped.
-        """ 
-        while self.running:
+        Back off exponentially while the key state is stable.
+        """
+        if stable_ticks == 0:
+            return 1
+        limit: int = self.POLL_BACKOFF_MAX
+        if self.active_monitor:
+            # A removal must still be noticed well within the grace period.
+            limit = min(limit, max(1, self.seconds_grace // 2))
+        return min(limit, 1 << min(stable_ticks, 5))
+
+    def _monitor_polling(self, stop_fd: int) -> None:
+        """
+        Poll the detector, backing off while nothing changes, until stop_fd is readable.
+        """
+        stable_ticks: int = 0
+        while True:
+            was_present: bool = self.previous_present
             self.monitor_iteration()
-            time.sleep(1)
+            if self.active_countdown or self.previous_present != was_present:
+                stable_ticks = 0
+            else:
+                stable_ticks += 1
+            if select.select([stop_fd], [], [], self._poll_interval(stable_ticks))[0]:
+                return
+
+    def _monitor_events(self, stop_fd: int, event_fd: int) -> None:
+        """
+        Block on detector (udev or inotify) events, only ticking once per second while counting down,
+        until stop_fd is readable.
+        """
+        next_tick: float = self._clock()
+        while True:
+            now: float = self._clock()
+            if now >= next_tick or self.detection_instance.search_yubikey_exists() != self.previous_present:
+                self.monitor_iteration()
+                next_tick = now + 1
+            timeout: Optional[float] = None
+            if (
+                self.active_countdown
+                or self._notification_close_due is not None
+                or self.detection_instance.pending_rescan()
+            ):
+                timeout = max(0.0, next_tick - self._clock())
+            readable, _, _ = select.select([stop_fd, event_fd], [], [], timeout)
+            if stop_fd in readable:
+                return
+
+    def monitor(self) -> None:
+        """
+        Continuously monitor the YubiKey state until a handled signal such as SIGTERM arrives.
+        """
+        # Signals write to the wakeup pipe, so they interrupt the wait immediately.
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_w, False)
+        previous_wakeup_fd: int = signal.set_wakeup_fd(wakeup_w)
+        try:
+            event_fd: Optional[int] = self.detection_instance.fileno()
+            if event_fd is None:
+                self._monitor_polling(wakeup_r)
+            else:
+                self._monitor_events(wakeup_r, event_fd)
+        finally:
+            signal.set_wakeup_fd(previous_wakeup_fd)
+            os.close(wakeup_r)
+            os.close(wakeup_w)
 
 
 def main() -> None:
@@ -192,10 +243,11 @@ def main() -> None:
     """
     monitor_instance: Monitor = Monitor(grace_period=10)
 
-    # Signal handler to set the running flag to False for graceful exit.
+    # The handler itself does nothing; installing it makes SIGTERM reach the
+    # wakeup fd of monitor() instead of killing the process outright.
     def handle_sigterm(signum: int, frame: Optional[object]) -> None:
-        monitor_instance.running = False
-   
+        pass
+
     signal.signal(signal.SIGTERM, handle_sigterm)
     monitor_instance.monitor()
 
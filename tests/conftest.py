@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Shared pytest fixtures.
+"""
+
+import pytest
+
+
+class FakeClock:
+    """
+    Monotonic clock that only moves when advanced.
+    """
+
+    def __init__(self, start: float = 100.0) -> None:
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_clock() -> FakeClock:
+    return FakeClock()
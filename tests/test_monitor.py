@@ -3,7 +3,15 @@
 Pytest tests for the Monitor module.
 """
 
-from monitor import Monitor, YubiDetect
+import os
+import select
+import signal
+import threading
+import time
+import types
+
+import monitor
+from monitor import Monitor, YubiDetect, _detect_gui
 
 
 class DummyDetection(YubiDetect):
@@ -17,6 +25,93 @@ class DummyDetection(YubiDetect):
             self.index += 1
         return state
 
+    def fileno(self):
+        return None
+
+
+class EventDetection(YubiDetect):
+    # Detector backed by a real pipe, the way udev or inotify hand out a descriptor.
+    def __init__(self, present):
+        self.present = present
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+
+    def fileno(self):
+        return self.read_fd
+
+    def pending_rescan(self) -> bool:
+        return False
+
+    def search_yubikey_exists(self) -> bool:
+        try:
+            os.read(self.read_fd, 64)
+        except BlockingIOError:
+            pass
+        return self.present
+
+    def event(self, present=None):
+        if present is not None:
+            self.present = present
+        os.write(self.write_fd, b"x")
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def run_event_loop(monkeypatch, clock, monitor_instance, steps):
+    # Run monitor() with select() replaced by a stepper: every call records its
+    # timeout, advances the clock (by the timeout when no amount is given) and
+    # applies the step's action. Once the steps run out the stop fd is reported.
+    timeouts = []
+    def fake_select(rlist, wlist, xlist, timeout):
+        timeouts.append(timeout)
+        if not steps:
+            return [rlist[0]], [], []
+        advance, action = steps.pop(0)
+        clock.advance(timeout if advance is None else advance)
+        if action is not None:
+            action()
+        return select.select(rlist, [], [], 0)
+    monkeypatch.setattr(monitor, "select", types.SimpleNamespace(select=fake_select))
+    monkeypatch.setattr(monitor, "subprocess", types.SimpleNamespace(run=lambda *args, **kwargs: None))
+    monitor_instance.monitor()
+    return timeouts
+
+
+def record_key_absent(clock, monitor_instance):
+    absent_at = []
+    key_absent = monitor_instance.key_absent
+    def recording() -> None:
+        absent_at.append(clock())
+        key_absent()
+    monitor_instance.key_absent = recording
+    return absent_at
+
+
+class RecordingNotification:
+    def __init__(self):
+        self.closed = False
+
+    def update(self, title, message):
+        pass
+
+    def show(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def reinserted_monitor(clock, states):
+    # Run the given states up to and including a reinsertion, on a fake clock.
+    monitor_instance = Monitor(grace_period=10, detector=DummyDetection(states), clock=clock)
+    notification = RecordingNotification()
+    monitor_instance.last_notification_id = notification
+    for _ in range(states.index(True, 2)):
+        monitor_instance.monitor_iteration()
+    return monitor_instance, notification
+
 
 def test_monitor_lock() -> None:
     # Simulate: key is initially present then becomes absent long enough to trigger a lock.
@@ -27,3 +122,115 @@ def test_monitor_lock() -> None:
         monitor_instance.monitor_iteration()
     # After the grace period, the monitor should disable further activity.
     assert not monitor_instance.active_monitor
+
+
+def test_monitor_reinserted(fake_clock) -> None:
+    # Simulate: key is removed briefly and put back before the grace period ends.
+    monitor_instance, notification = reinserted_monitor(fake_clock, [True, True, False, False, True])
+    assert monitor_instance.active_monitor
+    assert monitor_instance.countdown_iteration == 0
+    assert not monitor_instance.active_countdown
+    # The reinsertion notice stays up until its deadline, then gets closed and replaced.
+    monitor_instance.monitor_iteration()
+    assert not notification.closed
+    fake_clock.advance(monitor_instance.REINSERTED_NOTIFICATION_SECONDS)
+    monitor_instance.monitor_iteration()
+    assert notification.closed
+    assert monitor_instance.last_notification_id is not notification
+    assert monitor_instance._notification_close_due is None
+
+
+def test_monitor_removed_during_reinsert_notice(fake_clock) -> None:
+    # Simulate: the key is pulled again while the reinsertion notice is still up.
+    monitor_instance, notification = reinserted_monitor(fake_clock, [True, True, False, True, False])
+    fake_clock.advance(1)
+    monitor_instance.monitor_iteration()
+    assert monitor_instance.active_countdown
+    # The countdown took the notification over, so the pending close is dropped.
+    fake_clock.advance(monitor_instance.REINSERTED_NOTIFICATION_SECONDS)
+    monitor_instance.monitor_iteration()
+    assert not notification.closed
+    assert monitor_instance.last_notification_id is notification
+
+
+def test_event_loop_countdown_cadence(monkeypatch, fake_clock) -> None:
+    detector = EventDetection(present=True)
+    monitor_instance = Monitor(grace_period=10, detector=detector, clock=fake_clock)
+    absent_at = record_key_absent(fake_clock, monitor_instance)
+    steps = [(0.5, lambda: detector.event(present=False))] + [(None, None)] * 3
+    timeouts = run_event_loop(monkeypatch, fake_clock, monitor_instance, steps)
+    detector.close()
+    # Idle with the key present: block without a timeout.
+    assert timeouts[0] is None
+    # The removal event starts the countdown, which then ticks once per second.
+    assert absent_at == [100.5, 101.5, 102.5, 103.5]
+    assert timeouts[1:] == [1.0] * 4
+
+
+def test_event_loop_ignores_unrelated_events(monkeypatch, fake_clock) -> None:
+    detector = EventDetection(present=True)
+    monitor_instance = Monitor(grace_period=10, detector=detector, clock=fake_clock)
+    absent_at = record_key_absent(fake_clock, monitor_instance)
+    steps = [(0.5, lambda: detector.event(present=False)), (0.25, detector.event), (None, None)]
+    timeouts = run_event_loop(monkeypatch, fake_clock, monitor_instance, steps)
+    detector.close()
+    # Another USB device showing up mid-countdown neither ticks nor shifts the cadence.
+    assert absent_at == [100.5, 101.5]
+    assert timeouts[2] == 0.75
+
+
+def test_event_loop_blocks_after_lock(monkeypatch, fake_clock) -> None:
+    detector = EventDetection(present=True)
+    monitor_instance = Monitor(grace_period=1, detector=detector, clock=fake_clock)
+    steps = [(0.5, lambda: detector.event(present=False)), (None, None)]
+    timeouts = run_event_loop(monkeypatch, fake_clock, monitor_instance, steps)
+    detector.close()
+    assert not monitor_instance.active_monitor
+    assert timeouts == [None, 1.0, None]
+
+
+def run_until_sigterm(monitor_instance) -> float:
+    # Send SIGTERM shortly after monitor() starts and time how long it takes to return.
+    previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+    try:
+        start = time.monotonic()
+        timer.start()
+        monitor_instance.monitor()
+        return time.monotonic() - start
+    finally:
+        timer.cancel()
+        signal.signal(signal.SIGTERM, previous_handler)
+
+
+def test_sigterm_stops_polling_loop() -> None:
+    monitor_instance = Monitor(grace_period=10, detector=DummyDetection([True]))
+    # The poll interval is already 2 s here, so returning early proves the wakeup fd works.
+    assert run_until_sigterm(monitor_instance) < 1
+
+
+def test_sigterm_stops_event_loop() -> None:
+    detector = EventDetection(present=True)
+    monitor_instance = Monitor(grace_period=10, detector=detector)
+    # Idle with the key present the loop waits without a timeout.
+    assert run_until_sigterm(monitor_instance) < 1
+    detector.close()
+
+
+def test_detect_gui() -> None:
+    assert _detect_gui(("ubuntu", "gnome"), wayland=True) == "gnome"
+    assert _detect_gui(("x-cinnamon",), wayland=False) == "cinnamon"
+    # Tokens are compared whole, not as substrings.
+    assert _detect_gui(("automate",), wayland=False) is None
+    assert _detect_gui(("",), wayland=True) == "sway"
+    # With several known desktops the dispatch order decides.
+    assert _detect_gui(("sway", "kde", "gnome"), wayland=True) == "gnome"
+
+
+def test_poll_interval_backoff() -> None:
+    monitor_instance = Monitor(grace_period=10, detector=DummyDetection([True]))
+    assert monitor_instance._poll_interval(0) == 1
+    assert monitor_instance._poll_interval(2) == 4
+    assert monitor_instance._poll_interval(10) == 5
+    monitor_instance.active_monitor = False
+    assert monitor_instance._poll_interval(10) == 30
@@ -3,6 +3,10 @@
 Pytest tests for the YubiDetect module.
 """
 
+import errno
+import types
+
+import yubi_detect
 from yubi_detect import YubiDetect
 
 def test_parse_device_rules_empty() -> None:
@@ -23,3 +27,143 @@ def test_search_usb_device() -> None:
     assert YubiDetect._search_usb_device(device_data, device="0405")
     assert not YubiDetect._search_usb_device(device_data, vendor="9999")
     assert not YubiDetect._search_usb_device(device_data, device="0000")
+
+class DummyUdevDevice(dict):
+    def __init__(self, sys_path, **properties):
+        super().__init__(properties)
+        self.sys_path = sys_path
+
+def test_handle_udev_event() -> None:
+    detector = YubiDetect(True)
+    key = DummyUdevDevice("/sys/devices/usb1/1-1", ID_VENDOR_ID="1050", ID_MODEL_ID="0407")
+    other = DummyUdevDevice("/sys/devices/usb1/1-2", ID_VENDOR_ID="046d", ID_MODEL_ID="c52b")
+    detector._handle_udev_event("add", other)
+    assert not detector._present_devices
+    detector._handle_udev_event("add", key)
+    assert detector._present_devices == {key.sys_path}
+    detector._handle_udev_event("remove", DummyUdevDevice(key.sys_path))
+    assert not detector._present_devices
+
+def test_enumerate_sysfs(tmp_path, monkeypatch) -> None:
+    for name, vendor, device in (("1-1", "1050", "0407"), ("usb1", "1d6b", "0002")):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "idVendor").write_text(vendor + "\n")
+        (tmp_path / name / "idProduct").write_text(device + "\n")
+    (tmp_path / "1-1:1.0").mkdir()
+    monkeypatch.setattr(YubiDetect, "SYSFS_USB_DEVICES", str(tmp_path))
+    # Keep the host's udev/inotify event sources out of the polled path.
+    monkeypatch.setattr(yubi_detect, "pyudev", None)
+    monkeypatch.setattr(yubi_detect, "inotify_simple", None)
+    assert sorted(YubiDetect._enumerate_sysfs()) == [("1050", "0407"), ("1d6b", "0002")]
+    assert YubiDetect._enumerate_sysfs("1050") == [("1050", "0407")]
+    assert YubiDetect(False).search_yubikey_exists()
+
+def test_search_yubikey_exists_cached(monkeypatch) -> None:
+    calls = []
+    def fake_enumerate(vendor_filter=None):
+        calls.append(None)
+        return [("1050", "0407")]
+    detector = YubiDetect(True)
+    monkeypatch.setattr(detector, "_enumerate_devices", fake_enumerate)
+    assert detector.search_yubikey_exists()
+    assert detector.search_yubikey_exists()
+    assert len(calls) == 1
+    assert detector._cached_present(ttl=0)
+    assert len(calls) == 2
+
+def test_get_key_data_skips_missing_products(monkeypatch) -> None:
+    # 0402 is absent, so 0405 must still be reported.
+    detector = YubiDetect(True)
+    monkeypatch.setattr(detector, "_enumerate_devices", lambda vendor_filter=None: [("1050", "0405")])
+    assert detector.get_key_data() == ("1050", "0405")
+    assert detector.get_key_data(all_key_data=True) == [("1050", "0405")]
+    assert detector.get_number_keys() == 1
+
+def test_udev_unavailable_falls_back(monkeypatch) -> None:
+    class BrokenContext:
+        def __init__(self):
+            raise ImportError("libudev not found")
+    monkeypatch.setattr(yubi_detect, "pyudev", types.SimpleNamespace(Context=BrokenContext))
+    monkeypatch.setattr(yubi_detect, "inotify_simple", None)
+    detector = YubiDetect(False)
+    assert detector.fileno() is None
+
+def test_inotify_unavailable_falls_back(monkeypatch, tmp_path) -> None:
+    class ExhaustedINotify:
+        def __init__(self):
+            raise OSError(errno.EMFILE, "Too many open files")
+    monkeypatch.setattr(yubi_detect, "pyudev", None)
+    monkeypatch.setattr(yubi_detect, "inotify_simple", types.SimpleNamespace(INotify=ExhaustedINotify))
+    monkeypatch.setattr(YubiDetect, "USB_DEVICE_NODES", str(tmp_path))
+    detector = YubiDetect(False)
+    assert detector.fileno() is None
+    assert not detector.pending_rescan()
+
+class FakeINotify:
+    def __init__(self):
+        self.watches = []
+        self.pending = []
+
+    def add_watch(self, path, mask):
+        self.watches.append(path)
+        return len(self.watches)
+
+    def read(self, timeout=None):
+        events, self.pending = self.pending, []
+        return events
+
+    def fileno(self):
+        return -1
+
+FAKE_FLAGS = types.SimpleNamespace(CREATE=1, DELETE=2, MOVED_TO=4, MOVED_FROM=8, ISDIR=16)
+
+def make_inotify_detector(monkeypatch, tmp_path, clock, scans):
+    # scans is a list of enumeration results, the last one repeats.
+    (tmp_path / "001").mkdir()
+    calls = []
+    monkeypatch.setattr(yubi_detect, "pyudev", None)
+    monkeypatch.setattr(yubi_detect, "inotify_simple", types.SimpleNamespace(INotify=FakeINotify, flags=FAKE_FLAGS))
+    monkeypatch.setattr(YubiDetect, "USB_DEVICE_NODES", str(tmp_path))
+    detector = YubiDetect(False, clock=clock)
+    def fake_enumerate(vendor_filter=None):
+        calls.append(None)
+        return scans[min(len(calls), len(scans)) - 1]
+    monkeypatch.setattr(detector, "_enumerate_devices", fake_enumerate)
+    return detector, calls
+
+def test_inotify_removal_race(monkeypatch, tmp_path, fake_clock) -> None:
+    key = [("1050", "0407")]
+    # The node is gone but sysfs still lists the key on the first scan.
+    detector, calls = make_inotify_detector(monkeypatch, tmp_path, fake_clock, [key, key, [], []])
+    assert detector.search_yubikey_exists()
+    detector._inotify.pending = [types.SimpleNamespace(wd=2, mask=FAKE_FLAGS.DELETE, name="005")]
+    assert detector.search_yubikey_exists()
+    assert detector.pending_rescan()
+    fake_clock.advance(1)
+    assert not detector.search_yubikey_exists()
+    fake_clock.advance(1)
+    assert not detector.search_yubikey_exists()
+    assert not detector.pending_rescan()
+
+def test_inotify_rescan_and_cache(monkeypatch, tmp_path, fake_clock) -> None:
+    key = [("1050", "0407")]
+    detector, calls = make_inotify_detector(monkeypatch, tmp_path, fake_clock, [key])
+    assert detector.fileno() == -1
+    assert detector._inotify.watches == [str(tmp_path), str(tmp_path / "001")]
+    # Two agreeing scans settle the detector.
+    assert detector.search_yubikey_exists()
+    fake_clock.advance(1)
+    assert detector.search_yubikey_exists()
+    assert len(calls) == 2
+    # No event: the cache is returned without scanning, however old it is.
+    fake_clock.advance(3600)
+    assert detector.search_yubikey_exists()
+    assert len(calls) == 2
+    # An event forces a scan, and a new bus directory gets its own watch.
+    (tmp_path / "002").mkdir()
+    detector._inotify.pending = [
+        types.SimpleNamespace(wd=1, mask=FAKE_FLAGS.CREATE | FAKE_FLAGS.ISDIR, name="002")
+    ]
+    assert detector.search_yubikey_exists()
+    assert len(calls) == 3
+    assert detector._inotify.watches[-1] == str(tmp_path / "002")
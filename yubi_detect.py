@@ -1,36 +1,151 @@
 #!/usr/bin/env python3
 """
-Module for detecting YubiKey devices via lsusb.
+Module for detecting YubiKey devices via lsusb, sysfs, udev or inotify events.
 """
 
-import re
+import os
 import subprocess
+import time
 from datetime import datetime
-from typing import List, Tuple, Optional, Union
+from itertools import repeat
+from typing import Any, Callable, FrozenSet, List, Tuple, Optional, Set, Union
+
+try:
+    import pyudev
+except ImportError:  # pyudev is optional, fall back to inotify or polling.
+    pyudev = None
+
+try:
+    import inotify_simple
+except ImportError:  # inotify_simple is optional as well.
+    inotify_simple = None
 
 
 class YubiDetect:
     """
-    Detects YubiKey devices by parsing lsusb output.
+    Detects YubiKey devices by parsing lsusb output, or by tracking udev
+    netlink events when lsusb is not requested and pyudev is available.
+    Without pyudev the device list is read from sysfs instead of lsusb, and is
+    only re-read when inotify reports device nodes changing under /dev/bus/usb.
     """
 
     VENDOR: str = "1050"  # Yubico vendor ID.
     PRODUCTS: List[str] = ["0402", "0405", "0407"]  # Supported product codes.
+    _KEY_IDS: FrozenSet[Tuple[str, str]] = frozenset(zip(repeat(VENDOR), PRODUCTS))
 
-    LSUSB_CMD: str = "lsusb"
-    LS_USB_PARSE_EXPRESSION: str = (
-        r"^Bus\s+(?P<bus>\d{1,3})\s+\w+\s+(?P<device_id>\d{1,3}):\s+ID\s+"
-        r"(?P<vendor>[a-f0-9]{4}):(?P<device>[a-f0-9]{4})\s+(.+)$"
-    )
+    LSUSB_CMD: List[str] = ["lsusb"]
+    SYSFS_USB_DEVICES: str = "/sys/bus/usb/devices"
+    USB_DEVICE_NODES: str = "/dev/bus/usb"
+    PRESENCE_CACHE_TTL: float = 0.25  # Seconds a polled presence result is reused.
 
-    def __init__(self, use_lsusb: bool = True) -> None:
+    def __init__(self, use_lsusb: bool = True, clock: Callable[[], float] = time.monotonic) -> None:
         self.use_lsusb = use_lsusb
+        self._clock: Callable[[], float] = clock  # Monotonic seconds, injectable for tests.
+        self._udev_monitor: Optional[Any] = None
+        self._inotify: Optional[Any] = None
+        self._inotify_root_wd: int = -1
+        self._inotify_settling: bool = False  # Re-scan until two scans after an event agree.
+        self._inotify_last_scan: Optional[bool] = None
+        self._present_devices: Set[str] = set()
+        self._cache_ts: float = float("-inf")
+        self._cache_val: bool = False
+        if not use_lsusb:
+            if pyudev is not None:
+                try:
+                    self._start_udev_monitor()
+                except (ImportError, OSError):  # No libudev or no netlink, degrade to the fallbacks.
+                    self._udev_monitor = None
+                    self._present_devices.clear()
+            if self._udev_monitor is None and inotify_simple is not None and os.path.isdir(self.USB_DEVICE_NODES):
+                try:
+                    self._start_inotify_watch()
+                except OSError:  # Out of inotify instances or watches, degrade to polling.
+                    if self._inotify is not None:
+                        self._inotify.close()
+                    self._inotify = None
+                    self._inotify_settling = False
+
+    def _start_udev_monitor(self) -> None:
+        """
+        Subscribe to udev USB events and seed the presence cache.
+        """
+        context = pyudev.Context()
+        self._udev_monitor = pyudev.Monitor.from_netlink(context)
+        self._udev_monitor.filter_by("usb", "usb_device")
+        self._udev_monitor.start()
+        for device in context.list_devices(subsystem="usb", DEVTYPE="usb_device"):
+            self._handle_udev_event("add", device)
+
+    def _handle_udev_event(self, action: Optional[str], device: Any) -> None:
+        """
+        Update the presence cache from a single udev event.
+        """
+        if action == "remove":
+            self._present_devices.discard(device.sys_path)
+        elif action == "add":
+            if (device.get("ID_VENDOR_ID"), device.get("ID_MODEL_ID")) in self._KEY_IDS:
+                self._present_devices.add(device.sys_path)
+
+    def _drain_udev_events(self) -> None:
+        """
+        Apply all pending udev events without blocking.
+        """
+        while True:
+            device = self._udev_monitor.poll(timeout=0)
+            if device is None:
+                return
+            self._handle_udev_event(device.action, device)
+
+    def _start_inotify_watch(self) -> None:
+        """
+        Watch /dev/bus/usb and each bus directory for device nodes coming and going.
+        """
+        self._inotify = inotify_simple.INotify()
+        self._inotify_root_wd = self._inotify.add_watch(self.USB_DEVICE_NODES, self._inotify_mask())
+        for entry in os.scandir(self.USB_DEVICE_NODES):
+            if entry.is_dir():
+                self._inotify.add_watch(entry.path, self._inotify_mask())
+        self._inotify_settling = True  # Nothing has been scanned yet.
+
+    @staticmethod
+    def _inotify_mask() -> int:
+        """
+        Events signalling a device node being added or removed.
+        """
+        flags = inotify_simple.flags
+        return flags.CREATE | flags.DELETE | flags.MOVED_TO | flags.MOVED_FROM
+
+    def _drain_inotify_events(self) -> bool:
+        """
+        Consume pending inotify events without blocking; True if any arrived.
+        """
+        events = self._inotify.read(timeout=0)
+        for event in events:
+            if event.wd == self._inotify_root_wd and event.mask & inotify_simple.flags.ISDIR:
+                bus_path = os.path.join(self.USB_DEVICE_NODES, event.name)
+                if os.path.isdir(bus_path):  # A new bus appeared.
+                    try:
+                        self._inotify.add_watch(bus_path, self._inotify_mask())
+                    except OSError:  # Gone again or no watches left; the event still forces a rescan.
+                        pass
+        return bool(events)
+
+    def fileno(self) -> Optional[int]:
+        """
+        Return the udev or inotify descriptor to wait on, or None when polling.
+        """
+        if self._udev_monitor is not None:
+            return self._udev_monitor.fileno()
+        if self._inotify is not None:
+            return self._inotify.fileno()
+        return None
 
     def _get_device_tree(self) -> str:
         """
         Retrieve the lsusb output.
         """
-        output_bytes: bytes = subprocess.check_output(self.LSUSB_CMD, shell=True)
+        # Descriptors are non-inheritable by default, so skip the close_fds sweep.
+        output_bytes: bytes = subprocess.check_output(self.LSUSB_CMD, stderr=subprocess.DEVNULL, close_fds=False)
         return output_bytes.decode()
 
     @classmethod
@@ -38,14 +153,48 @@ class YubiDetect:
         """
         Parse lsusb output and extract vendor and device IDs.
         """
+        # Lines look like "Bus 001 Device 002: ID 1050:0407 Yubico ...".
         device_list: List[Tuple[str, str]] = []
         for line in data.splitlines():
-            match = re.search(cls.LS_USB_PARSE_EXPRESSION, line)
-            if match:
-                groups = match.groupdict()
-                device_list.append((groups["vendor"], groups["device"]))
+            if not line.startswith("Bus "):
+                continue
+            start = line.find(" ID ") + 4
+            ids = line[start:start + 9]
+            if start >= 4 and len(ids) == 9 and ids[4] == ":":
+                device_list.append((ids[:4], ids[5:]))
         return device_list
 
+    @classmethod
+    def _enumerate_sysfs(cls, vendor_filter: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Read vendor and device IDs of USB devices straight from sysfs,
+        skipping the product read for devices of other vendors.
+        """
+        device_list: List[Tuple[str, str]] = []
+        for entry in os.scandir(cls.SYSFS_USB_DEVICES):
+            if ":" in entry.name:  # Interfaces, not devices.
+                continue
+            try:
+                with open(os.path.join(entry.path, "idVendor"), "rb") as vendor_file:
+                    vendor = vendor_file.read(4).decode()
+                if vendor_filter is not None and vendor != vendor_filter:
+                    continue
+                with open(os.path.join(entry.path, "idProduct"), "rb") as device_file:
+                    device = device_file.read(4).decode()
+            except OSError:  # Device went away or has no descriptor files.
+                continue
+            device_list.append((vendor, device))
+        return device_list
+
+    def _enumerate_devices(self, vendor_filter: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        List the vendor and device IDs of attached USB devices, optionally of one vendor only.
+        """
+        if self.use_lsusb:
+            devices = self._parse_device_rules(self._get_device_tree())
+            return [dev for dev in devices if vendor_filter is None or dev[0] == vendor_filter]
+        return self._enumerate_sysfs(vendor_filter)
+
     @classmethod
     def _search_usb_device(
         cls, device_data: Tuple[str, str], vendor: Optional[str] = None, device: Optional[str] = None
@@ -66,21 +215,69 @@ class YubiDetect:
         """
         Search for a device matching the given vendor and device IDs.
         """
-        tree = self._get_device_tree()
-        devices = self._parse_device_rules(tree)
+        devices = self._enumerate_devices()
         return any(self._search_usb_device(dev, vendor, device) for dev in devices)
 
     def search_yubikey_exists(self) -> bool:
         """
         Determine if any supported YubiKey is present.
         """
-        return any(self.search_device(self.VENDOR, prod) for prod in self.PRODUCTS)
+        if self._udev_monitor is not None:
+            self._drain_udev_events()
+            return bool(self._present_devices)
+        if self._inotify is not None:
+            return self._inotify_present()
+        return self._cached_present()
+
+    def _inotify_present(self) -> bool:
+        """
+        Answer from the cache between device node events, re-scanning after one.
+        """
+        if self._drain_inotify_events():
+            self._cache_ts = float("-inf")  # Scan right away.
+            self._inotify_settling = True
+            self._inotify_last_scan = None
+        if not self._inotify_settling:
+            return self._cache_val
+        # The kernel unlinks the /dev node before it removes the sysfs entry,
+        # so a single scan right after the event can still see the key. Keep
+        # scanning, at most once per PRESENCE_CACHE_TTL, until two scans agree.
+        previous_ts = self._cache_ts
+        present = self._cached_present()
+        if self._cache_ts != previous_ts:
+            self._inotify_settling = present != self._inotify_last_scan
+            self._inotify_last_scan = present
+        return present
+
+    def pending_rescan(self) -> bool:
+        """
+        True while the detector needs to be asked again without a new event.
+        """
+        return self._inotify_settling
+
+    def _cached_present(self, ttl: Optional[float] = None) -> bool:
+        """
+        Enumerate the bus for a YubiKey, reusing a result younger than ttl seconds.
+        """
+        ttl = self.PRESENCE_CACHE_TTL if ttl is None else ttl
+        now = self._clock()
+        if now - self._cache_ts >= ttl:
+            self._cache_val = not self._KEY_IDS.isdisjoint(self._enumerate_devices(self.VENDOR))
+            self._cache_ts = now
+        return self._cache_val
+
+    def _find_key_products(self) -> List[str]:
+        """
+        List the supported product codes present, from a single enumeration.
+        """
+        present = set(self._enumerate_devices(self.VENDOR))
+        return [prod for prod in self.PRODUCTS if (self.VENDOR, prod) in present]
 
     def get_number_keys(self) -> int:
         """
         Count the number of detected YubiKeys.
         """
-        return sum(1 for prod in self.PRODUCTS if self.search_device(self.VENDOR, prod))
+        return len(self._find_key_products())
 
     def get_key_data(
         self, all_key_data: bool = False
@@ -88,7 +285,7 @@ class YubiDetect:
         """
         Retrieve YubiKey data.
         """
-        found = [(self.VENDOR, prod) for prod in self.PRODUCTS if self.search_device(self.VENDOR, prod)]
+        found = [(self.VENDOR, prod) for prod in self._find_key_products()]
         return found if all_key_data else (found[0] if found else None)
 
 